@@ -1,3 +1,6 @@
+import os
+import shutil
+import numpy as np
 import pandas as pd
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
@@ -33,7 +36,10 @@ def get_OLS_results(dataset, lags, formula = 'delta_midprice ~ OFI', time_int =
     -----------
     This function performs Ordinary Least Squares (OLS) regression on a dataset using the specified
     formula. It groups the data by the specified time interval, fits the OLS model for each group,
-    and returns the regression results as a Series.
+    and returns the regression results as a Series. A formula of the form 'response ~ regressor_1 + ...'
+    with plain column names is parsed only once into a design matrix, with an 'Intercept' column added
+    to the regressors. Any other formula, such as 'delta_midprice ~ OFI - 1', is fitted per group with
+    `sm.formula.ols`.
 
     Example
     -------
@@ -41,8 +47,22 @@ def get_OLS_results(dataset, lags, formula = 'delta_midprice ~ OFI', time_int =
     
     >>> results = get_OLS_results(df, lags=2, formula='delta_midprice ~ OFI', time_int='30Min', covariation_type='HAC')
     '''
-    return dataset.groupby(pd.Grouper(freq = time_int)).apply(lambda dataset: sm.formula.ols(formula, data = dataset)
-    .fit(cov_type = covariation_type, cov_kwds={'maxlags':lags}))
+    parsed = _simple_formula(formula, dataset.columns)
+    results = {}
+    if parsed is None:
+        for timestamp, group in dataset.groupby(pd.Grouper(freq = time_int)):
+            results[timestamp] = sm.formula.ols(formula, data = group)\
+                .fit(cov_type = covariation_type, cov_kwds={'maxlags':lags})
+        return pd.Series(results)
+
+    response, regressors = parsed
+    design = dataset[[response] + regressors]
+    design.insert(1, 'Intercept', 1.0)
+
+    for timestamp, group in design.groupby(pd.Grouper(freq = time_int)):
+        results[timestamp] = sm.OLS(group.iloc[:, 0], group.iloc[:, 1:], missing = 'drop')\
+            .fit(cov_type = covariation_type, cov_kwds={'maxlags':lags})
+    return pd.Series(results)
 
 def get_beta_coef(OLS_results, Flow_imbalance = 'OFI'):
     '''Extract beta coefficients from a series of OLS regression results.
@@ -73,10 +93,91 @@ def get_beta_coef(OLS_results, Flow_imbalance = 'OFI'):
     
     >>> beta_coefs = get_beta_coef(results, Flow_imbalance='OFI')
     '''
-    aux_list = []
-    for i in OLS_results:
-        aux_list.append(i.params[Flow_imbalance])
-    return pd.Series(aux_list)
+    return OLS_results.map(lambda results: results.params[Flow_imbalance])
+
+def parse_formula(formula):
+    '''Split a simple regression formula into its response and regressor names.
+
+    Parameters
+    ----------
+    formula : str
+        A formula of the form 'response ~ regressor_1 + regressor_2 + ...'.
+
+    Returns
+    -------
+    tuple
+        The response name and a list of regressor names.
+
+    Raises
+    ------
+    ValueError
+        If the formula is not of that form with plain names, for example 'delta_midprice ~ OFI - 1'
+        or 'delta_midprice ~ OFI:TFI'.
+
+    Example
+    -------
+    >>> response, regressors = parse_formula('delta_midprice ~ OFI')
+    '''
+    sides = formula.split('~')
+    names = [sides[0].strip()] + [regressor.strip() for regressor in sides[-1].split('+')]
+    if len(sides) != 2 or not all(name.isidentifier() for name in names):
+        raise ValueError(f"Expected a formula of the form 'response ~ regressor_1 + regressor_2 + ...' "
+                         f"with plain column names, got {formula!r}.")
+    return names[0], names[1:]
+
+def _simple_formula(formula, columns):
+    '''Return `parse_formula(formula)` if it names only `columns`, and None for any other formula.'''
+    try:
+        response, regressors = parse_formula(formula)
+    except ValueError:
+        return None
+    return (response, regressors) if set([response] + regressors) <= set(columns) else None
+
+def get_OLS_beta_coef(dataset, formula = 'delta_midprice ~ OFI', time_int = '30Min'):
+    '''Estimate the OLS slope of a single-regressor formula for each time interval in closed form.
+
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        A DataFrame containing the data for regression analysis.
+
+    formula : str, optional
+        The formula for the OLS regression model with exactly one regressor (default is 'delta_midprice ~ OFI').
+
+    time_int : str, optional
+        The time interval for grouping the data (default is '30Min').
+
+    Returns
+    -------
+    pd.Series
+        A Series containing the beta coefficients of the regressor, indexed by time interval.
+
+    Description
+    -----------
+    This function gives the same slopes as `get_beta_coef(get_OLS_results(...))` without fitting a
+    statsmodels model per group. The data is grouped once and each slope is computed from the grouped
+    sums as beta = (n * Sxy - Sx * Sy) / (n * Sxx - Sx^2). The covariance estimator only affects the
+    standard errors, so use `get_OLS_results` when those are needed.
+
+    Example
+    -------
+    To estimate the slope of 'OFI' for every 30-minute interval of a dataset `df`, you can call the function like this:
+
+    >>> beta_coefs = get_OLS_beta_coef(df, formula='delta_midprice ~ OFI', time_int='30Min')
+    '''
+    response, regressors = parse_formula(formula)
+    if len(regressors) != 1:
+        raise ValueError(f'Closed-form OLS needs exactly one regressor, got {regressors}.')
+
+    x = dataset[regressors[0]]
+    y = dataset[response]
+    valid = x.notna() & y.notna()
+    sums = pd.DataFrame({'n': 1.0, 'x': x, 'y': y, 'xx': x * x, 'xy': x * y})[valid]\
+        .groupby(pd.Grouper(freq = time_int)).sum()
+
+    beta = (sums['n'] * sums['xy'] - sums['x'] * sums['y']) / (sums['n'] * sums['xx'] - sums['x'] ** 2)
+    beta.name = regressors[0]
+    return beta
 
 def create_dataframe(beta_series, depth_series):
     '''Create a DataFrame from beta coefficients and average depth series.
@@ -107,14 +208,105 @@ def create_dataframe(beta_series, depth_series):
     
     >>> df = create_dataframe(beta_series, depth_series)
     '''
-    start_datetime = depth_series.index.min()
-    end_datetime = depth_series.index.max()
+    return pd.DataFrame({'beta_coef': beta_series, 'avg_depth': depth_series})    
+
+def write_OFI_TFI_dataset(csv_path = 'Data/2020-11-15_2020-11-30.csv', dataset_path = 'Data/ofi_tfi', chunksize = 500_000):
+    '''Convert the precomputed OFI and TFI data from a CSV file to a Parquet dataset partitioned by date.
+
+    Parameters
+    ----------
+    csv_path : str, optional
+        The path of the CSV file with 'delta_midprice', 'OFI' and 'TFI' columns indexed by timestamp
+        (default is 'Data/2020-11-15_2020-11-30.csv').
+
+    dataset_path : str, optional
+        The directory in which the dataset is written, one 'date=YYYY-MM-DD' subdirectory per day
+        (default is 'Data/ofi_tfi').
+
+    chunksize : int, optional
+        The number of CSV rows read and written at a time (default is 500000).
+
+    Returns
+    -------
+    None
+
+    Description
+    -----------
+    This function reads the CSV file and writes it as a Parquet dataset partitioned by date, so that
+    `load_OFI_TFI_data` only has to decode the days it is asked for. The CSV file is streamed in chunks
+    of `chunksize` rows, which caps the peak memory regardless of its size. The dataset is written to a
+    temporary directory first and moved into place when complete, replacing an existing dataset.
+
+    Example
+    -------
+    To convert the CSV file shipped in the Data folder, you can call the function like this:
+    
+    >>> write_OFI_TFI_dataset('Data/2020-11-15_2020-11-30.csv', 'Data/ofi_tfi')
+    '''
+    column_types = {
+        'delta_midprice': 'float64',
+        'OFI': 'float64',
+        'TFI': 'float64'
+        }
+
+    temporary_path = dataset_path + '.tmp'
+    shutil.rmtree(temporary_path, ignore_errors=True)
+
+    chunks = pd.read_csv(csv_path, dtype=column_types, index_col=0, parse_dates=True, chunksize=chunksize)
+    for number, chunk in enumerate(chunks):
+        chunk['date'] = chunk.index.strftime('%Y-%m-%d')
+        chunk.to_parquet(temporary_path, engine='pyarrow', partition_cols=['date'],
+                         basename_template=f'part-{number}-{{i}}.parquet')
+
+    # A directory can only be renamed onto a missing path, so the old dataset is moved aside first.
+    old_path = dataset_path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(dataset_path):
+        os.replace(dataset_path, old_path)
+    os.replace(temporary_path, dataset_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def load_OFI_TFI_data(start_date, end_date, dataset_path = 'Data/ofi_tfi', csv_path = 'Data/2020-11-15_2020-11-30.csv'):
+    '''Load the precomputed OFI and TFI data for a date range from the date-partitioned Parquet dataset.
+
+    Parameters
+    ----------
+    start_date : str
+        The start date in the format 'YYYY-MM-DD'.
+
+    end_date : str
+        The end date in the format 'YYYY-MM-DD'.
 
-    datetime_index = pd.date_range(start=start_datetime, end=end_datetime, freq='30T')
+    dataset_path : str, optional
+        The directory of the dataset written by `write_OFI_TFI_dataset` (default is 'Data/ofi_tfi').
+
+    csv_path : str, optional
+        The CSV file the dataset is created from (default is 'Data/2020-11-15_2020-11-30.csv').
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame containing 'delta_midprice', 'OFI' and 'TFI' data from start_date to end_date
+        inclusive, indexed by timestamp.
+
+    Description
+    -----------
+    The date filter is pushed down to PyArrow, so only the partitions of the requested days are read.
+    If the dataset does not exist yet or the CSV file has been modified since it was written, it is first
+    (re)created from the CSV file with `write_OFI_TFI_dataset`.
+
+    Example
+    -------
+    To load the OFI and TFI data from '2020-11-15' to '2020-11-20', you can call the function like this:
     
-    beta_series = pd.Series(beta_series.values, index=datetime_index, name='timestamp')
+    >>> data = load_OFI_TFI_data('2020-11-15', '2020-11-20')
+    '''
+    if not os.path.exists(dataset_path) or \
+            (os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(dataset_path)):
+        write_OFI_TFI_dataset(csv_path=csv_path, dataset_path=dataset_path)
 
-    return pd.DataFrame({'beta_coef': beta_series, 'avg_depth': depth_series})    
+    data = pd.read_parquet(dataset_path, engine='pyarrow', filters=[('date', '>=', start_date), ('date', '<=', end_date)])
+    return data.drop(columns='date').sort_index()
 
 def finished_df(start_date, end_date, lags = 4, formula = 'delta_midprice ~ OFI', time_int = '30Min', covariation_type = 'HAC', Flow_imbalance='OFI'):
     '''Generate a DataFrame containing beta coefficients, average depth values, and other metrics for a specified date range.
@@ -150,9 +342,11 @@ def finished_df(start_date, end_date, lags = 4, formula = 'delta_midprice ~ OFI'
 
     Description
     -----------
-    This function reads data from CSV files, performs OLS regression, extracts beta coefficients, and creates
-    a DataFrame containing beta coefficients, average depth values, and other metrics. The data is filtered
-    to include only the specified date range.
+    This function reads the data of the specified date range with `load_OFI_TFI_data` and the average depths
+    from a CSV file, performs OLS regression, extracts beta coefficients, and creates a DataFrame containing beta
+    coefficients, average depth values, and other metrics. When `Flow_imbalance` is the only regressor of `formula`, the
+    beta coefficients are computed in closed form by `get_OLS_beta_coef`, for which `lags` and
+    `covariation_type` make no difference.
 
     Example
     -------
@@ -161,25 +355,22 @@ def finished_df(start_date, end_date, lags = 4, formula = 'delta_midprice ~ OFI'
     
     >>> df = finished_df('2023-09-11', '2023-09-15', lags=4, formula='delta_midprice ~ OFI', time_int='30Min', covariation_type='HAC', Flow_imbalance='OFI')
     '''
-    column_types = {
-        'delta_midprice': 'float64',
-        'OFI': 'float64',
-        'TFI': 'float64'
-        }
+    if end_date <= start_date:
+        print('End date should be greater than start date.')
+        return None
 
-    data = pd.read_csv('Data/2020-11-15_2020-11-30.csv', dtype=column_types, index_col=0, parse_dates=True)
+    data = load_OFI_TFI_data(start_date, end_date)
     D = pd.read_csv('Data/avg_depths-2020-11.csv', index_col=0, parse_dates=True)
     D = D.squeeze()
 
-    beta = get_beta_coef(get_OLS_results(data, lags=lags, formula=formula, time_int=time_int, covariation_type=covariation_type), 
-                         Flow_imbalance=Flow_imbalance)
-    
-    if end_date > start_date:
-        filtered_data = create_dataframe(beta, D)[start_date:end_date]
-        return filtered_data
+    parsed = _simple_formula(formula, data.columns)
+    if parsed is not None and parsed[1] == [Flow_imbalance]:
+        beta = get_OLS_beta_coef(data, formula=formula, time_int=time_int)
     else:
-        print('End date should be greater than start date.')
-        return None
+        beta = get_beta_coef(get_OLS_results(data, lags=lags, formula=formula, time_int=time_int, covariation_type=covariation_type), 
+                             Flow_imbalance=Flow_imbalance)
+    
+    return create_dataframe(beta, D[start_date:end_date])
 
 def list_of_halfhour_timestamps():
     '''Generate a list of timestamps representing half-hour intervals in a 24-hour day.
@@ -201,12 +392,7 @@ def list_of_halfhour_timestamps():
     
     >>> timestamps = list_of_halfhour_timestamps()
     '''
-    times = []
-    for hour in range(24):
-        for minute in ['00', '30']:
-            time_str = f"{hour:02d}:{minute}"
-            times.append(time_str)
-    return times
+    return pd.date_range('00:00', '23:30', freq='30min').strftime('%H:%M').tolist()
 
 def get_graph(beta_D_data):
     '''Generate a line plot showing normalized beta and depth values over half-hour intervals.
@@ -225,7 +411,9 @@ def get_graph(beta_D_data):
     -----------
     This function takes a DataFrame `beta_D_data` containing beta coefficients, average depth values, and
     timestamps. It calculates the global means of beta and depth, normalizes the data, and then generates
-    a line plot to visualize the normalized values over half-hour intervals.
+    a line plot to visualize the normalized values over half-hour intervals. The rows are grouped by an
+    integer half-hour code (2 * hour + 1 for the second half of the hour) rather than by formatted time strings,
+    and `beta_D_data` itself is left unchanged.
 
     Example
     -------
@@ -235,12 +423,14 @@ def get_graph(beta_D_data):
     >>> get_graph(df)
     '''
     halfhour_list = list_of_halfhour_timestamps() 
-    beta_D_data['time'] = beta_D_data.index.strftime('%H:%M:%S')
+    index = beta_D_data.index
+    bin_code = index.hour.values.astype(np.int16) * 2 + (index.minute.values >= 30).astype(np.int16)
 
     global_depth = beta_D_data.avg_depth.mean()
     global_beta = beta_D_data.beta_coef.mean()
-    means_beta = beta_D_data.groupby('time').beta_coef.mean()
-    means_depth = beta_D_data.groupby('time').avg_depth.mean()
+    means = beta_D_data[['beta_coef', 'avg_depth']].groupby(bin_code, sort=False).mean().reindex(range(len(halfhour_list)))
+    means_beta = means.beta_coef
+    means_depth = means.avg_depth
     
     normalized_beta = means_beta/global_beta
     normalized_depth = means_depth/global_depth
@@ -1,7 +1,90 @@
+import hashlib
+import os
+import numpy as np
 import pandas as pd 
-from datetime import timedelta, datetime
-
-def load_df_quotes(datum):
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pyarrow import csv, fs
+
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+CACHE_DIR = 'cache'
+# Format version of the cached files, to be increased whenever a change to the calculations or to the
+# stored dtypes makes the existing caches stale.
+CACHE_VERSION = 1
+# Directory or URL (such as 's3://bucket/BTCUSDT') holding the quotes/ and trades/ daily files.
+BASE_PATH = os.environ.get('BINANCE_BASE', '/Users/marekerben/Desktop/Prakticka/binance-futures/BTCUSDT')
+
+class DataReadError(Exception):
+    '''Raised when a daily data file is missing, truncated or cannot be parsed.'''
+
+def _cache_path(kind, *key):
+    '''Path of the Parquet file caching the `kind` result computed for the given key.'''
+    return os.path.join(CACHE_DIR, kind, '_'.join(str(k) for k in (f'v{CACHE_VERSION}',) + key) + '.parquet')
+
+def _dataset_key(base = None):
+    '''Cache key of the data set under `base` (BASE_PATH by default): its last path component followed
+    by a short hash of the whole normalized path or URL, which keeps the caches of different data sets apart.
+    '''
+    uri = base or BASE_PATH
+    if '://' not in uri:
+        uri = os.path.abspath(os.path.expanduser(uri))
+    uri = uri.rstrip('/')
+    return f'{os.path.basename(uri)}-{hashlib.sha1(uri.encode()).hexdigest()[:10]}'
+
+def _store_cache(data_frame, cache_path):
+    '''Write `data_frame` to `cache_path` atomically, so that an interrupted run leaves no partial file.'''
+    os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+    data_frame.to_parquet(cache_path + '.tmp')
+    os.replace(cache_path + '.tmp', cache_path)
+
+def _read_csv(path, coltypes):
+    '''Read the `coltypes` columns of a (gzipped) CSV file with the multithreaded PyArrow reader and
+    index the result by its integer microsecond 'timestamp' column. `path` is a local path or a URL
+    of any file system supported by PyArrow, such as 's3://...'. When python-isal is installed,
+    gzip files are decompressed with its ISA-L decoder, which is considerably faster than zlib, into
+    memory before they are parsed. Any failure to read the file is raised as `DataReadError`.
+    '''
+    options = {'read_options': csv.ReadOptions(use_threads = True),
+               'convert_options': csv.ConvertOptions(include_columns = list(coltypes), column_types = coltypes)}
+    try:
+        filesystem, file_path = fs.FileSystem.from_uri(path) if '://' in path else (fs.LocalFileSystem(), path)
+        if igzip is not None and file_path.endswith('.gz'):
+            # The threaded reader is only given a native Arrow buffer: reading from a Python file object,
+            # it can deadlock on the next file after a read has failed on a truncated one.
+            with filesystem.open_input_stream(file_path, compression = None) as raw:
+                source = pa.BufferReader(igzip.decompress(raw.read()))
+        else:
+            source = filesystem.open_input_stream(file_path)
+        with source:
+            table = csv.read_csv(source, **options)
+    # Missing files raise FileNotFoundError, truncated gzip files EOFError or OSError, and malformed
+    # CSV files ArrowInvalid.
+    except (EOFError, OSError, pa.ArrowInvalid) as error:
+        raise DataReadError(f'{path}: {error}') from error
+    timestamp = pd.DatetimeIndex(table.column('timestamp').to_numpy().view('datetime64[us]'), name = 'timestamp')
+    data_frame = table.drop(['timestamp']).to_pandas()
+    data_frame.index = timestamp
+    return data_frame
+
+def _read_day(kind, datum, coltypes, base = None):
+    '''Read the `kind` ('quotes' or 'trades') CSV file of the given day under `base` (BASE_PATH by
+    default), parsing it only on the first call and reading the Parquet copy of the parsed columns
+    written then on every later call.
+    '''
+    base = base or BASE_PATH
+    cache_path = _cache_path(kind, _dataset_key(base), datum)
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+    data_frame = _read_csv(f'{base.rstrip("/")}/{kind}/{datum}.csv.gz', coltypes)
+    _store_cache(data_frame, cache_path)
+    return data_frame
+
+def load_df_quotes(datum, base = None):
     '''Load a DataFrame containing cryptocurrency quote data from a CSV file.
 
     Parameters:
@@ -9,11 +92,26 @@ def load_df_quotes(datum):
     datum : str
         The date for which you want to load the quote data in the format 'YYYY-MM-DD'.
 
+    base : str, optional
+        The directory or URL holding the quotes/ directory of daily files (default is BASE_PATH,
+        which is taken from the BINANCE_BASE environment variable when it is set).
+
     Returns:
     --------
     pd.DataFrame
-        A DataFrame containing cryptocurrency quote data with columns for exchange, symbol,
-        timestamp, local timestamp, ask amount, ask price, bid price, and bid amount.
+        A DataFrame containing cryptocurrency quote data indexed by timestamp, with columns for
+        ask amount, ask price, bid price, and bid amount.
+
+    Description:
+    ------------
+    The file is decompressed and parsed by the multithreaded PyArrow CSV reader, which only converts
+    the columns used by the analysis. The integer microsecond timestamps are reinterpreted as a
+    DatetimeIndex without copying. The amounts are read as float32, which is precise enough for their
+    few decimal places. The prices stay float64, which holds the quoted decimals closely enough for
+    them to convert to exact whole ticks, so that mid-price differences are exact; float32 would move
+    them by up to a few thousandths at Bitcoin price levels. The parsed columns are stored as Parquet
+    under CACHE_DIR, so every later call for the same day reads them back instead of decompressing
+    and parsing the CSV file again.
 
     Example:
     --------
@@ -21,12 +119,11 @@ def load_df_quotes(datum):
     
     >>> df = load_df_quotes('2023-09-11')
     '''
-    coltypes = {'exchange': str, 'symbol': str, 'timestamp': int, 'local_timestamp': int, 'ask_amount': float, 
-                'ask_price': float, 'bid_price': float, 'bid_amount': float}
-    return pd.read_csv(f'/Users/marekerben/Desktop/Prakticka/binance-futures/BTCUSDT/quotes/{datum}.csv.gz', dtype = coltypes, 
-            index_col=['timestamp'], parse_dates=['timestamp'], date_parser=lambda d: pd.to_datetime(d, unit = 'us'))    
+    coltypes = {'timestamp': pa.int64(), 'ask_amount': pa.float32(), 'ask_price': pa.float64(), 'bid_price': pa.float64(), 
+                'bid_amount': pa.float32()}
+    return _read_day('quotes', datum, coltypes, base = base)
 
-def load_df_trades(datum):
+def load_df_trades(datum, base = None):
     '''Load a DataFrame containing cryptocurrency trade data from a CSV file.
 
     Parameters
@@ -34,11 +131,24 @@ def load_df_trades(datum):
     datum : str
         The date for which you want to load the trade data in the format 'YYYY-MM-DD'.
 
+    base : str, optional
+        The directory or URL holding the trades/ directory of daily files (default is BASE_PATH,
+        which is taken from the BINANCE_BASE environment variable when it is set).
+
     Returns
     -------
     pd.DataFrame
-        A DataFrame containing cryptocurrency trade data with columns for exchange, symbol,
-        timestamp, local timestamp, trade ID, side, price, and amount.
+        A DataFrame containing cryptocurrency trade data indexed by timestamp, with columns for
+        side, price, and amount.
+
+    Description
+    -----------
+    The file is decompressed and parsed by the multithreaded PyArrow CSV reader, which only converts
+    the columns used by the analysis. The integer microsecond timestamps are reinterpreted as a
+    DatetimeIndex without copying. The side is dictionary-encoded, giving a categorical column, and
+    the amount and price are read as float32 and float64 like in `load_df_quotes`. The parsed columns
+    are stored as Parquet under CACHE_DIR, so every later call for the same day reads them back instead
+    of decompressing and parsing the CSV file again.
 
     Example
     -------
@@ -46,19 +156,166 @@ def load_df_trades(datum):
     
     >>> df = load_df_trades('2023-09-11')
     '''
-    coltypes = {'exchange': str, 'symbol': str, 'timestamp': int, 'local_timestamp': int, 'id': int, 
-                'side': str, 'price': float, 'amount': float}
-    return pd.read_csv(f'/Users/marekerben/Desktop/Prakticka/binance-futures/BTCUSDT/trades/{datum}.csv.gz', dtype = coltypes, 
-            index_col=['timestamp'], parse_dates=['timestamp'], date_parser=lambda d: pd.to_datetime(d, unit = 'us'))   
+    coltypes = {'timestamp': pa.int64(), 'side': pa.dictionary(pa.int32(), pa.string()), 'price': pa.float64(), 
+                'amount': pa.float32()}
+    return _read_day('trades', datum, coltypes, base = base)
+
+@dataclass
+class QuoteArrays:
+    '''Structure-of-arrays form of quote data: the timestamps and the best bid and ask levels,
+    each held as one contiguous NumPy array, with the prices expressed as integer numbers of ticks,
+    or kept as the original float prices when they do not lie on the tick grid.
 
-def get_e_n(data_frame):
+    Example
+    -------
+    To convert quote data loaded for the date '2023-09-11', you can call the method like this:
+    
+    >>> quotes = QuoteArrays.from_frame(load_df_quotes('2023-09-11'))
+    '''
+    timestamp: pd.DatetimeIndex
+    bid_price: np.ndarray
+    bid_amount: np.ndarray
+    ask_price: np.ndarray
+    ask_amount: np.ndarray
+    tick_size: float = 0.01
+
+    @classmethod
+    def from_frame(cls, data_frame, tick_size = 0.01):
+        '''Extract the quote columns of a DataFrame, without copying the amounts that already are contiguous.
+        When all prices lie on the grid of `tick_size`, they are converted to whole numbers of ticks, so
+        that price changes are exact integer differences, held as int32 whenever they fit. Otherwise the
+        float64 prices are kept unchanged. Amounts keep a float32 dtype to halve their memory traffic.
+        '''
+        def amounts(column):
+            values = data_frame[column].to_numpy()
+            return np.ascontiguousarray(values, dtype = np.result_type(values.dtype, np.float32))
+
+        prices = [np.ascontiguousarray(data_frame[column].to_numpy(), dtype = np.float64) for column in ('bid_price', 'ask_price')]
+        ticks = [price / tick_size for price in prices]
+        # The division leaves an error far below 1e-6 tick on grid prices, while a relative tolerance
+        # would accept whole ticks of difference at Bitcoin price levels.
+        if all(np.allclose(tick, np.rint(tick), rtol = 0, atol = 1e-6) for tick in ticks):
+            ticks = [np.rint(tick) for tick in ticks]
+            # Leave headroom for the sum of the bid and ask prices in the mid price.
+            fits = max(np.abs(tick).max(initial = 0) for tick in ticks) <= np.iinfo(np.int32).max // 2
+            prices = [tick.astype(np.int32 if fits else np.int64) for tick in ticks]
+
+        return cls(timestamp = data_frame.index,
+                   bid_price = prices[0],
+                   bid_amount = amounts('bid_amount'),
+                   ask_price = prices[1],
+                   ask_amount = amounts('ask_amount'),
+                   tick_size = tick_size)
+
+    def mid_price(self):
+        '''Mid price of every quote in ticks, as `get_mid_price` calculates it.'''
+        in_ticks = np.issubdtype(self.bid_price.dtype, np.integer)
+        return get_mid_price(ask_price = self.ask_price, bid_price = self.bid_price, tick_size = 1 if in_ticks else self.tick_size)
+
+def _as_quote_arrays(quotes, tick_size = 0.01):
+    '''Accept either a quote DataFrame or `QuoteArrays` and return `QuoteArrays`.'''
+    return quotes if isinstance(quotes, QuoteArrays) else QuoteArrays.from_frame(quotes, tick_size = tick_size)
+
+def _order_book_changes(quotes):
+    '''Return the one-step price changes and the amounts of the best bid and ask of
+    `QuoteArrays`. A price change has one element less than the quotes, since the first quote has no
+    previous quote: its i-th element pairs quote i + 1 with quote i. The amounts of the previous
+    quotes are therefore the view `amount[:-1]`, aligned with `amount[1:]`, and need no shifted copy.
+    '''
+    changes = []
+    for side in ('bid', 'ask'):
+        price = getattr(quotes, f'{side}_price')
+        changes += [np.subtract(price[1:], price[:-1]), getattr(quotes, f'{side}_amount')]
+    return changes
+
+def _e_n_kernel(bid_change, bid_amount, ask_change, ask_amount):
+    # Accumulate the four signed terms into one array in place instead of combining four temporaries.
+    e_n = np.empty(len(bid_amount), dtype = np.result_type(bid_amount, ask_amount))
+    e_n[:1] = np.nan
+    terms = e_n[1:]
+    np.multiply(bid_change >= 0, bid_amount[1:], out = terms)
+    terms -= (bid_change <= 0) * bid_amount[:-1]
+    terms -= (ask_change <= 0) * ask_amount[1:]
+    terms += (ask_change >= 0) * ask_amount[:-1]
+    return e_n
+
+def _side_depth(current, previous, amount):
+    '''Depth contribution of every quote of one side: its own amount where `current` holds and the
+    amount of the previous quote where `previous` holds, both masks covering all quotes but the first.
+    '''
+    depth = np.empty_like(amount)
+    np.multiply(current, amount[1:], out = depth[1:])
+    depth[1:] += previous * amount[:-1]
+    return depth
+
+def _side_moves(change, amount):
+    moves = np.empty(len(amount), dtype = bool)
+    np.not_equal(change, 0, out = moves[1:])
+    return moves
+
+def _depth_terms(bid_change, bid_amount, ask_change, ask_amount, starts = slice(0, 1)):
+    '''Per-quote depth contributions and price-change indicators of the bid and ask sides. The quotes
+    at `starts`, which always include the first quote, are taken to have no previous quote.
+    '''
+    bid_depth = _side_depth(bid_change < 0, bid_change > 0, bid_amount)
+    ask_depth = _side_depth(ask_change > 0, ask_change < 0, ask_amount)
+    bid_moves = _side_moves(bid_change, bid_amount)
+    ask_moves = _side_moves(ask_change, ask_amount)
+    # A quote without a previous quote contributes no depth but counts as a price change, exactly like
+    # the NaN first row of the former pandas expression.
+    bid_depth[starts] = 0.0
+    ask_depth[starts] = 0.0
+    bid_moves[starts] = True
+    ask_moves[starts] = True
+    return bid_depth, bid_moves, ask_depth, ask_moves
+
+def _avg_depth_kernel(*changes):
+    bid_depth, bid_moves, ask_depth, ask_moves = _depth_terms(*changes)
+    return 0.5 * (bid_depth.sum(dtype = np.float64) / np.count_nonzero(bid_moves) +
+                  ask_depth.sum(dtype = np.float64) / np.count_nonzero(ask_moves))
+
+def _binned_avg_depth_kernel(quotes, bounds):
+    '''Average depth of every bin given by `bounds`, equal to `get_avg_depth` applied to each bin on its own.'''
+    # Within a bin the first quote has no previous quote, so no price change is carried across bins.
+    starts = bounds[:-1][np.diff(bounds) > 0]
+    bid_depth, bid_moves, ask_depth, ask_moves = _depth_terms(*_order_book_changes(quotes), starts = starts)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return 0.5 * (_bin_sum(bid_depth, bounds) / _bin_sum(bid_moves, bounds) +
+                      _bin_sum(ask_depth, bounds) / _bin_sum(ask_moves, bounds))
+
+def _time_bins(index, delta_t):
+    '''Split a sorted DatetimeIndex into consecutive `delta_t` bins anchored at midnight, like
+    `resample` does. Returns the bin labels and the positions where the bins start, followed by
+    the length of the index.
+    '''
+    if len(index) == 0:
+        return pd.DatetimeIndex([], name=index.name), np.zeros(1, dtype=np.intp)
+    freq = pd.Timedelta(delta_t)
+    origin = index[0].normalize()
+    labels = pd.date_range(origin + (index[0] - origin) // freq * freq, index[-1], freq=freq, name=index.name)
+    bounds = np.append(index.searchsorted(labels), len(index))
+    return labels, bounds
+
+def _bin_sum(values, bounds):
+    '''Sum `values` within the bins given by `bounds`, skipping NaN like `resample().sum()`.'''
+    counts = np.diff(bounds)
+    sums = np.zeros(len(counts))
+    nonempty = counts > 0
+    sums[nonempty] = np.add.reduceat(np.nan_to_num(values), bounds[:-1][nonempty], dtype = np.float64)
+    return sums
+
+def get_e_n(data_frame, tick_size = 0.01):
     '''Calculate the net exchange flow (e_n) for a given DataFrame of cryptocurrency data.
 
     Parameters
     ----------
-    data_frame : pd.DataFrame
+    data_frame : pd.DataFrame or QuoteArrays
         A DataFrame containing cryptocurrency data with columns for bid price, bid amount, 
-        ask price, and ask amount.
+        ask price, and ask amount, or the same data as `QuoteArrays`.
+
+    tick_size : float, optional
+        The tick size of the prices, used to hold them as whole numbers of ticks; ignored for
+        `QuoteArrays` (default is 0.01).
 
     Returns
     -------
@@ -77,10 +334,8 @@ def get_e_n(data_frame):
     
     >>> en = get_e_n(df)
     '''
-    return (data_frame['bid_price'].diff() >= 0) * data_frame['bid_amount'] - \
-        (data_frame['bid_price'].diff() <= 0) * data_frame['bid_amount'].shift(1)- \
-        (data_frame['ask_price'].diff() <= 0) * data_frame['ask_amount'] + \
-        (data_frame['ask_price'].diff() >= 0) * data_frame['ask_amount'].shift(1)
+    quotes = _as_quote_arrays(data_frame, tick_size = tick_size)
+    return pd.Series(_e_n_kernel(*_order_book_changes(quotes)), index=quotes.timestamp)
 
 def get_mid_price(ask_price, bid_price, tick_size = 0.01):
     '''Calculate the mid price based on the ask and bid prices.
@@ -134,7 +389,8 @@ def get_signed_amount_traded(data_frame):
     -----------
     This function calculates the signed amount traded for each row in the DataFrame. If the trade
     side is 'buy,' the amount is positive; if the trade side is 'sell,' the amount is negated
-    to represent a sell trade.
+    to represent a sell trade. The side is encoded as a +1/-1 sign array once and multiplied with
+    the amounts in a single vectorized operation.
 
     Example
     -------
@@ -143,9 +399,11 @@ def get_signed_amount_traded(data_frame):
     
     >>> signed_amount = get_signed_amount_traded(df)
     '''
-    return data_frame.apply(lambda row: row['amount'] if row['side'] == 'buy' else -1 * row['amount'], axis=1)
+    # For a categorical 'side' the comparison is made on the integer category codes.
+    sign = np.where((data_frame['side'] == 'buy').to_numpy(), 1, -1).astype(np.int8)
+    return pd.Series(sign * data_frame['amount'].to_numpy(), index=data_frame.index)
 
-def construct_OFI_TFI_dataframe(datum, delta_t = '10S', tick_size = 0.01):
+def construct_OFI_TFI_dataframe(datum, delta_t = '10S', tick_size = 0.01, base = None):
     '''Construct a DataFrame containing Order Flow Imbalance (OFI) and Traded Flow Imbalance (TFI) data.
 
     Parameters
@@ -157,7 +415,12 @@ def construct_OFI_TFI_dataframe(datum, delta_t = '10S', tick_size = 0.01):
         The time interval for resampling the data (default is '10S' - 10 seconds).
 
     tick_size : float, optional
-        The tick size used for mid price calculation (default is 0.01).
+        The tick size of the quoted prices, used to hold them as whole numbers of ticks and for mid
+        price calculation (default is 0.01).
+
+    base : str, optional
+        The directory or URL holding the quotes/ and trades/ directories of daily files (default is
+        BASE_PATH, which is taken from the BINANCE_BASE environment variable when it is set).
 
     Returns
     -------
@@ -169,7 +432,11 @@ def construct_OFI_TFI_dataframe(datum, delta_t = '10S', tick_size = 0.01):
     -----------
     This function loads quote and trade data for a specific date, calculates the change in mid price,
     Order Flow Imbalance (OFI), and Traded Flow Imbalance (TFI) over the specified time intervals, and 
-    constructs a DataFrame with these metrics.
+    constructs a DataFrame with these metrics. The bin boundaries are located once with a binary search
+    on the sorted timestamps, and every metric is then reduced per bin with vectorized NumPy operations.
+    `delta_t` must therefore be a fixed frequency such as '10S'. The result is cached as a Parquet file
+    in `CACHE_DIR` keyed by the data set, the date, `delta_t` and `tick_size`, and later calls read it
+    from there.
 
     Example
     -------
@@ -178,13 +445,25 @@ def construct_OFI_TFI_dataframe(datum, delta_t = '10S', tick_size = 0.01):
     
     >>> df = construct_OFI_TFI_dataframe('2023-09-11', delta_t='10S', tick_size=0.01)
     '''
-    quotes_df = load_df_quotes(datum)
-    trades_df = load_df_trades(datum)
+    cache_path = _cache_path('ofi_tfi', _dataset_key(base), datum, delta_t, tick_size)
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    quotes = QuoteArrays.from_frame(load_df_quotes(datum, base = base), tick_size = tick_size)
+    trades_df = load_df_trades(datum, base = base)
+
+    quote_bins, quote_bounds = _time_bins(quotes.timestamp, delta_t)
+    mid_price = quotes.mid_price()
+    first, last = quote_bounds[:-1], quote_bounds[1:] - 1
+    delta_midprice = np.where(last - first >= 1, mid_price[last] - mid_price[first], 0.0)
 
-    return pd.DataFrame({'delta_midprice': get_mid_price(ask_price = quotes_df['ask_price'], \
-        bid_price = quotes_df['bid_price'], tick_size=tick_size).resample(delta_t)\
-            .apply(lambda x: x.iloc[-1] - x.iloc[0] if len(x) >= 2 else 0), 'OFI': get_e_n(quotes_df).resample(delta_t).sum(),\
-             'TFI': get_signed_amount_traded(trades_df).resample(delta_t).sum()})
+    trade_bins, trade_bounds = _time_bins(trades_df.index, delta_t)
+
+    OFI_TFI_df = pd.DataFrame({'delta_midprice': pd.Series(delta_midprice, index=quote_bins),
+                               'OFI': pd.Series(_bin_sum(get_e_n(quotes).to_numpy(), quote_bounds), index=quote_bins),
+                               'TFI': pd.Series(_bin_sum(get_signed_amount_traded(trades_df).to_numpy(), trade_bounds), index=trade_bins)})
+    _store_cache(OFI_TFI_df, cache_path)
+    return OFI_TFI_df
 
 def date_range_list(start_date, end_date):
     '''Generate a list of dates within a specified date range.
@@ -213,16 +492,9 @@ def date_range_list(start_date, end_date):
     
     >>> date_list = date_range_list('2023-09-11', '2023-09-15')
     '''
-    list_of_dates = []
-    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-    current_date = start_date
-    while current_date <= end_date:
-        list_of_dates.append(current_date.strftime('%Y-%m-%d'))
-        current_date += timedelta(days=1)
-    return list_of_dates
-
-def output_df(start_date, end_date, delta_t = '10S', tick_size = 0.01):
+    return pd.date_range(start_date, end_date, freq='D').strftime('%Y-%m-%d').tolist()
+
+def output_df(start_date, end_date, delta_t = '10S', tick_size = 0.01, max_workers = None, base = None):
     '''Generate and concatenate Order Flow Imbalance (OFI) and Traded Flow Imbalance (TFI) DataFrames
     for a specified date range.
 
@@ -240,6 +512,13 @@ def output_df(start_date, end_date, delta_t = '10S', tick_size = 0.01):
     tick_size : float, optional
         The tick size used for mid price calculation (default is 0.01).
 
+    max_workers : int, optional
+        The number of worker processes used to process the dates (default is None - one per CPU core).
+
+    base : str, optional
+        The directory or URL holding the quotes/ and trades/ directories of daily files (default is
+        BASE_PATH, which is taken from the BINANCE_BASE environment variable when it is set).
+
     Returns
     -------
     pd.DataFrame
@@ -248,8 +527,9 @@ def output_df(start_date, end_date, delta_t = '10S', tick_size = 0.01):
     Description
     -----------
     This function generates OFI and TFI DataFrames for a range of dates within the specified date
-    range. It catches and handles potential errors during the data processing and concatenates the
-    results into a single DataFrame.
+    range. The dates are independent of each other, so they are processed in parallel worker processes.
+    Days whose files are missing, truncated or cannot be parsed are reported and skipped, while any
+    other error, such as a failure to write a cache file, is raised, and the results are concatenated into a single DataFrame in date order.
 
     Example
     -------
@@ -259,27 +539,38 @@ def output_df(start_date, end_date, delta_t = '10S', tick_size = 0.01):
     >>> df = output_df('2023-09-11', '2023-09-15', delta_t='10S', tick_size=0.01)
     '''
     dates_list = date_range_list(start_date, end_date)
-
-    results = []
-    for i in dates_list:
-        try:
-            results.append(construct_OFI_TFI_dataframe(datum = i, delta_t = delta_t, tick_size = tick_size))
-            print(f'{i} done!')
-        except IndexError:
-            print(f'Index error: {i}')
-        except:
-            print(f'Other error: {i}')
+    # Resolved here, so that the workers read the data set of this process even if BASE_PATH was changed.
+    base = base or BASE_PATH
+
+    results = {}
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(construct_OFI_TFI_dataframe, datum = i, delta_t = delta_t, tick_size = tick_size,
+                                   base = base): i
+                   for i in dates_list}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+                print(f'{i} done!')
+            except IndexError:
+                print(f'Index error: {i}')
+            except DataReadError as error:
+                print(f'Could not read data: {i} ({error})')
     
-    return pd.concat(results)
+    return pd.concat((results[i] for i in dates_list if i in results), copy = False, sort = False)
 
-def get_avg_depth(df):
+def get_avg_depth(df, tick_size = 0.01):
     '''Calculate the average depth of the order book from a DataFrame of cryptocurrency quote data.
 
     Parameters
     ----------
-    df : pd.DataFrame
+    df : pd.DataFrame or QuoteArrays
         A DataFrame containing cryptocurrency quote data with columns for bid price and bid amount,
-        as well as ask price and ask amount.
+        as well as ask price and ask amount, or the same data as `QuoteArrays`.
+
+    tick_size : float, optional
+        The tick size of the prices, used to hold them as whole numbers of ticks; ignored for
+        `QuoteArrays` (default is 0.01).
 
     Returns
     -------
@@ -297,10 +588,57 @@ def get_avg_depth(df):
     
     >>> avg_depth = get_avg_depth(df)
     '''
-    return 0.5 *(((((df['bid_price'].diff() < 0) * df['bid_amount'] + (df['bid_price'].diff() > 0) * df['bid_amount'].shift(1))).sum()/((df['bid_price'].diff() != 0).sum()) + 
-(((df['ask_price'].diff() > 0) * df['ask_amount'] + (df['ask_price'].diff() < 0) * df['ask_amount'].shift(1))).sum()/((df['ask_price'].diff() != 0).sum())))
+    return _avg_depth_kernel(*_order_book_changes(_as_quote_arrays(df, tick_size = tick_size)))
+
+def get_daily_avg_depths(datum, time_int = '30Min', tick_size = 0.01, base = None):
+    '''Calculate the average depth of the order book for a single date over a specified time interval.
+
+    Parameters
+    ----------
+    datum : str
+        The date for which you want to calculate the average depths in the format 'YYYY-MM-DD'.
 
-def get_all_avg_depths(start_date, end_date, time_int = '30Min'):
+    time_int : str, optional
+        The time interval for resampling the data (default is '30Min').
+
+    tick_size : float, optional
+        The tick size of the quoted prices, used to hold them as whole numbers of ticks (default is 0.01).
+
+    base : str, optional
+        The directory or URL holding the quotes/ and trades/ directories of daily files (default is
+        BASE_PATH, which is taken from the BINANCE_BASE environment variable when it is set).
+
+    Returns
+    -------
+    pd.Series
+        A Series containing the calculated average depths of the order book, indexed by timestamp.
+
+    Description
+    -----------
+    This function loads the quote data for a specific date and calculates the average depth of the order
+    book for every time interval, as `get_avg_depth` would on each interval separately. All intervals are
+    computed at once with per-interval sums over the whole day, and intervals without quotes are NaN.
+    The result is cached as a Parquet file in `CACHE_DIR` keyed by the data set, the date, `time_int`
+    and `tick_size`, and later calls read it from there.
+
+    Example
+    -------
+    To calculate the average depths of the order book on '2023-09-11' with a time interval of '30Min',
+    you can call the function like this:
+    
+    >>> avg_depths = get_daily_avg_depths('2023-09-11', time_int='30Min')
+    '''
+    cache_path = _cache_path('avg_depth', _dataset_key(base), datum, time_int, tick_size)
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)['avg_depth']
+
+    quotes = QuoteArrays.from_frame(load_df_quotes(datum, base = base), tick_size = tick_size)
+    bins, bounds = _time_bins(quotes.timestamp, time_int)
+    avg_depths = pd.Series(_binned_avg_depth_kernel(quotes, bounds), index=bins, name='avg_depth')
+    _store_cache(avg_depths.to_frame(), cache_path)
+    return avg_depths
+
+def get_all_avg_depths(start_date, end_date, time_int = '30Min', tick_size = 0.01, base = None):
     '''Calculate the average depth of the order book over a specified date range and time interval.
 
     Parameters
@@ -314,6 +652,13 @@ def get_all_avg_depths(start_date, end_date, time_int = '30Min'):
     time_int : str, optional
         The time interval for resampling the data (default is '30Min').
 
+    tick_size : float, optional
+        The tick size of the quoted prices, used to hold them as whole numbers of ticks (default is 0.01).
+
+    base : str, optional
+        The directory or URL holding the quotes/ and trades/ directories of daily files (default is
+        BASE_PATH, which is taken from the BINANCE_BASE environment variable when it is set).
+
     Returns
     -------
     pd.Series
@@ -332,17 +677,40 @@ def get_all_avg_depths(start_date, end_date, time_int = '30Min'):
     >>> avg_depths = get_all_avg_depths('2023-09-11', '2023-09-15', time_int='30Min')
     '''
     dates_list = date_range_list(start_date = start_date, end_date = end_date)
-    series = pd.concat([load_df_quotes(i).resample(time_int).apply(lambda x: get_avg_depth(x)) for i in dates_list], axis = 0)
+    series = pd.concat([get_daily_avg_depths(i, time_int = time_int, tick_size = tick_size, base = base) for i in dates_list], axis = 0)
     series.name = 'avg_depth'
     return series
 
-#def control(df):
-    '''
-    Dodělat je to kontrola jestli máme všechny řádky v našem spočítáném df, tedy jestli ve všech 10s intervalech byli kotace a jsou tam data.
-    Stalo se mi, že když nebyli data, tak to ty řádky vynechalo. přes np.where(np.array == False)[0]
+def control(df, delta_t = '10S'):
+    '''Check that a DataFrame built by `output_df` has a row for every time interval.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        A DataFrame indexed by the start timestamps of its time intervals, such as the output of `output_df`.
+
+    delta_t : str, optional
+        The time interval the DataFrame was resampled at (default is '10S' - 10 seconds).
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        The start timestamps of the intervals between the first and last row of `df` that have no row;
+        empty when nothing is missing.
+
+    Description
+    -----------
+    Rows can be missing from the output when there was no data in some intervals, for example when a
+    day could not be processed. The complete range of interval timestamps is built with the given
+    frequency and the set difference with the index of `df` is returned, which also works when the
+    lengths of the two differ.
+
+    Example
+    -------
+    To check the OFI and TFI DataFrame from '2023-09-11' to '2023-09-15' for missing 10 second
+    intervals, you can call the function like this:
+    
+    >>> missing = control(output_df('2023-09-11', '2023-09-15'), delta_t='10S')
     '''
-    start_timestamp = df.index.min()
-    end_timestamp = df.index.max()
-    # Generate a new complete date and time range with a 10-second frequency
-    complete_index = pd.date_range(start=start_timestamp, end=end_timestamp, freq='10S')
-    return sum(df.index == complete_index)
+    complete_index = pd.date_range(start = df.index.min(), end = df.index.max(), freq = delta_t)
+    return complete_index.difference(df.index)